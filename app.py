@@ -6,6 +6,7 @@ from datetime import date
 import pandas as pd
 import streamlit as st
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import (
     Alignment,
     Border,
@@ -14,6 +15,17 @@ from openpyxl.styles import (
     Side,
 )
 from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.xml import LXML
+
+# openpyxl serializes write-only sheets through lxml when it is installed and
+# silently falls back to the much slower stdlib XML writer otherwise. lxml is a
+# declared dependency, so fail fast instead of taking the slow path.
+if not LXML:
+    raise ImportError(
+        "openpyxl cannot use lxml, which the Excel export requires: "
+        "install the locked project dependencies and make sure OPENPYXL_LXML is not set to False"
+    )
 
 # ---------------------------------------------------------------------------
 # Constants / style helpers
@@ -27,12 +39,41 @@ FILL_ORANGE = PatternFill(start_color="F4CCAF", end_color="F4CCAF", fill_type="s
 FONT_TITLE = Font(bold=True, size=18)
 FONT_NORMAL = Font(size=12)
 FONT_BOLD_12 = Font(bold=True, size=12)
+FONT_BOLD = Font(bold=True)
 
 ALIGN_CENTER = Alignment(horizontal="center", vertical="center")
+ALIGN_RIGHT = Alignment(horizontal="right", vertical="center")
+ALIGN_CENTER_TOP = Alignment(horizontal="center", vertical="top")
 ALIGN_CENTER_WRAP = Alignment(
     horizontal="center", vertical="center", wrap_text=True, text_rotation=90
 )
 
+# Point column labels (a, b, c, ...)
+LETTERS = tuple(string.ascii_lowercase)
+
+# Shared (font, alignment, fill[, number_format]) bundles, applied via _apply_style.
+# None entries keep the cell's default.
+STYLE_TITLE = (FONT_TITLE, ALIGN_CENTER, None)
+STYLE_TITLE_RIGHT = (FONT_TITLE, ALIGN_RIGHT, None)
+STYLE_DATE = (FONT_TITLE, ALIGN_CENTER, None, "DD.MM.YYYY")
+STYLE_GRAY = (None, None, FILL_GRAY)
+STYLE_GRAY_CENTER = (None, ALIGN_CENTER, FILL_GRAY)
+STYLE_DESCRIPTION = (FONT_NORMAL, ALIGN_CENTER_WRAP, FILL_GRAY)
+STYLE_DESCRIPTION_EMPTY = (None, ALIGN_CENTER_WRAP, FILL_GRAY)
+STYLE_HEADER = (FONT_BOLD_12, ALIGN_CENTER, FILL_GRAY)
+STYLE_POINT_HEADER = (FONT_BOLD_12, ALIGN_CENTER, FILL_ORANGE)
+STYLE_VALUE = (FONT_NORMAL, ALIGN_CENTER, FILL_GRAY)
+STYLE_AVERAGE = (FONT_NORMAL, ALIGN_CENTER, FILL_GRAY, "0.00")
+
+# All thin/medium combinations used by _set_medium_outline, keyed by (left, right, top, bottom)
+OUTLINE_BORDERS = {
+    (left, right, top, bottom): Border(left=left, right=right, top=top, bottom=bottom)
+    for left in (THIN, MEDIUM)
+    for right in (THIN, MEDIUM)
+    for top in (THIN, MEDIUM)
+    for bottom in (THIN, MEDIUM)
+}
+
 
 # ---------------------------------------------------------------------------
 # Session state helpers for dynamic Aufgaben
@@ -92,53 +133,75 @@ def _sync_descriptions(a_idx: int, t_idx: int, new_punkte: int):
 # ---------------------------------------------------------------------------
 # Dummy template generation
 # ---------------------------------------------------------------------------
+TEMPLATE_NACHNAMEN = (
+    "Müller", "Schmidt", "Schneider", "Fischer", "Weber",
+    "Meyer", "Wagner", "Becker", "Schulz", "Hoffmann",
+    "Koch", "Richter",
+)
+TEMPLATE_VORNAMEN = (
+    "Anna", "Ben", "Clara", "David", "Eva",
+    "Felix", "Greta", "Hans", "Ida", "Jan",
+    "Klara", "Lukas",
+)
+
+
+@st.cache_data
 def generate_template() -> bytes:
-    dummy = pd.DataFrame(
-        {
-            "Matr-Nr": [f"{100000 + i}" for i in range(12)],
-            "Nachname": [
-                "Müller", "Schmidt", "Schneider", "Fischer", "Weber",
-                "Meyer", "Wagner", "Becker", "Schulz", "Hoffmann",
-                "Koch", "Richter",
-            ],
-            "Vorname": [
-                "Anna", "Ben", "Clara", "David", "Eva",
-                "Felix", "Greta", "Hans", "Ida", "Jan",
-                "Klara", "Lukas",
-            ],
-        }
-    )
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+
+    header_cells = []
+    for h in ("Matr-Nr", "Nachname", "Vorname"):
+        # Header style pandas (2.x) to_excel used for this template
+        cell = WriteOnlyCell(ws, value=h)
+        cell.font = FONT_BOLD
+        cell.alignment = ALIGN_CENTER_TOP
+        cell.border = OUTLINE_BORDERS[(THIN, THIN, THIN, THIN)]
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    for i, (nachname, vorname) in enumerate(zip(TEMPLATE_NACHNAMEN, TEMPLATE_VORNAMEN)):
+        ws.append([f"{100000 + i}", nachname, vorname])
+
     buf = io.BytesIO()
-    dummy.to_excel(buf, index=False, engine="openpyxl")
-    buf.seek(0)
+    wb.save(buf)
     return buf.getvalue()
 
 
 # ---------------------------------------------------------------------------
 # Excel generation helpers
 # ---------------------------------------------------------------------------
-def _set_medium_outline(ws, min_row, max_row, min_col, max_col):
+def _set_medium_outline(cell_at, min_row, max_row, min_col, max_col):
     for r in range(min_row, max_row + 1):
         for c in range(min_col, max_col + 1):
             left = MEDIUM if c == min_col else THIN
             right = MEDIUM if c == max_col else THIN
             top = MEDIUM if r == min_row else THIN
             bottom = MEDIUM if r == max_row else THIN
-            ws.cell(row=r, column=c).border = Border(
-                left=left, right=right, top=top, bottom=bottom
-            )
+            cell_at(row=r, column=c).border = OUTLINE_BORDERS[(left, right, top, bottom)]
 
 
-def build_studenten_sheet(wb: Workbook, students: pd.DataFrame, studis_pro_mappe: int):
-    ws = wb.active
-    ws.title = "Studenten"
+def _apply_style(cell, font, alignment, fill, number_format=None):
+    if font is not None:
+        cell.font = font
+    if alignment is not None:
+        cell.alignment = alignment
+    if fill is not None:
+        cell.fill = fill
+    if number_format is not None:
+        cell.number_format = number_format
+
+
+def _centered_cell(ws, value) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value=value)
+    cell.alignment = ALIGN_CENTER
+    return cell
 
-    headers = ["Mappe", "Stelle in Mappe", "KlausurCode", "Matrikelnummer", "Nachname", "Vorname"]
-    for c, h in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=c, value=h)
-        cell.font = Font(bold=True)
-        cell.alignment = ALIGN_CENTER
 
+def build_studenten_sheet(wb: Workbook, students: pd.DataFrame, studis_pro_mappe: int):
+    ws = wb.create_sheet("Studenten")
+
+    # Write-only sheets need their dimensions before the first row is appended
     ws.column_dimensions["A"].width = 8
     ws.column_dimensions["B"].width = 16
     ws.column_dimensions["C"].width = 14
@@ -146,39 +209,33 @@ def build_studenten_sheet(wb: Workbook, students: pd.DataFrame, studis_pro_mappe
     ws.column_dimensions["E"].width = 20
     ws.column_dimensions["F"].width = 20
 
-    for idx, (_, row) in enumerate(students.iterrows()):
-        r = idx + 2
-        mappe = idx // studis_pro_mappe + 1
-        stelle = idx % studis_pro_mappe
-        ws.cell(row=r, column=1, value=mappe).alignment = ALIGN_CENTER
-        ws.cell(row=r, column=2, value=stelle).alignment = ALIGN_CENTER
-        ws.cell(row=r, column=3, value=f"{mappe}_{stelle}").alignment = ALIGN_CENTER
-        ws.cell(row=r, column=4, value=str(row.iloc[0])).alignment = ALIGN_CENTER
-        ws.cell(row=r, column=5, value=str(row.iloc[1])).alignment = ALIGN_CENTER
-        ws.cell(row=r, column=6, value=str(row.iloc[2])).alignment = ALIGN_CENTER
-
-
-def build_mappe_sheet(
-    wb: Workbook,
-    sheet_name: str,
-    aufgaben: list[dict],
-    students_in_mappe: pd.DataFrame,
-    mappe_nr: int,
-    semester: str,
-    exam_date,
-):
-    """Create one sheet per Mappe with all Aufgaben side by side.
-
-    Layout:
-        A-E: student info
-        Then ALL SUM blocks together: [SS S S | SS S | ...]  (one per Aufgabe)
-        Then ALL point columns:       [a b c | a b | a b c d | ...]
-    """
-    ws = wb.create_sheet(title=sheet_name)
-    n_students = len(students_in_mappe)
-    n_aufgaben = len(aufgaben)
-
-    # --- Compute column positions ---
+    headers = ["Mappe", "Stelle in Mappe", "KlausurCode", "Matrikelnummer", "Nachname", "Vorname"]
+    header_cells = []
+    for h in headers:
+        cell = _centered_cell(ws, h)
+        cell.font = FONT_BOLD
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    # Mappe, Stelle and KlausurCode for all students in one vectorized pass
+    idx = pd.RangeIndex(len(students))
+    mappen = idx // studis_pro_mappe + 1
+    stellen = idx % studis_pro_mappe
+    codes = mappen.astype(str) + "_" + stellen.astype(str)
+
+    # Stringify all student columns up front instead of per cell
+    student_values = students.map(str).to_numpy()
+    for mappe, stelle, code, (matr, nachname, vorname) in zip(
+        mappen.tolist(), stellen.tolist(), codes.tolist(), student_values
+    ):
+        ws.append([
+            _centered_cell(ws, value)
+            for value in (mappe, stelle, code, matr, nachname, vorname)
+        ])
+
+
+def _compute_aufgabe_layouts(aufgaben: list[dict]) -> list[dict]:
+    """Compute the column positions of every Aufgabe on a Mappe sheet."""
     # Phase 1: Place all SUM blocks (SS + S cols) starting at column F
     aufgabe_layouts: list[dict] = []
     col = 6
@@ -206,224 +263,253 @@ def build_mappe_sheet(
             lay["teil_point_starts"].append(col)
             col += pts
 
+    return aufgabe_layouts
+
+
+def _compute_col_letters(aufgabe_layouts: list[dict]) -> list:
+    """Column letters for every used column, indexed by column number."""
+    max_col = max(
+        (lay["teil_point_starts"][-1] + lay["teil_punkte"][-1] - 1 for lay in aufgabe_layouts),
+        default=5,
+    )
+    return [None] + [get_column_letter(c) for c in range(1, max_col + 1)]
+
+
+def _compute_formula_templates(aufgabe_layouts: list[dict], col_letters: list) -> list[dict]:
+    """Precompute the row-independent SUM formulas for each Aufgabe.
+
+    They only depend on the column layout, so all Mappe sheets share them.
+    """
+    templates = []
+    for lay in aufgabe_layouts:
+        ss_first = col_letters[lay["s_cols"][0]]
+        ss_last = col_letters[lay["s_cols"][-1]]
+        teil_ranges = [
+            (col_letters[start_c], col_letters[start_c + pts - 1])
+            for start_c, pts in zip(lay["teil_point_starts"], lay["teil_punkte"])
+        ]
+        templates.append({
+            "ss_range": (ss_first, ss_last),
+            "teil_ranges": teil_ranges,
+            "ss_sum_row5": f"=SUM({ss_first}5:{ss_last}5)",
+            "ss_sum_row6": f"=SUM({ss_first}6:{ss_last}6)",
+            "teil_sum_row5": [f"=SUM({fp}5:{lp}5)" for fp, lp in teil_ranges],
+            "teil_sum_row6": [f"=SUM({fp}6:{lp}6)" for fp, lp in teil_ranges],
+        })
+    return templates
+
+
+def _build_mappe_template(
+    aufgabe_layouts: list[dict],
+    formula_templates: list[dict],
+    col_letters: list,
+    semester: str,
+    exam_date,
+) -> dict:
+    """Precompute everything the Mappe sheets have in common.
+
+    Layout:
+        A-E: student info
+        Then ALL SUM blocks together: [SS S S | SS S | ...]  (one per Aufgabe)
+        Then ALL point columns:       [a b c | a b | a b c d | ...]
+
+    Rows 1-6 are identical on every sheet except for the Mappe number and the
+    student range of the row-6 averages, so they are stored as
+    (row, col, value, style) ops and replayed by build_mappe_sheet.
+    """
+    merges = []
+    cells = []
+
+    def merge(start_row, end_row, start_column, end_column):
+        merges.append(CellRange(min_row=start_row, max_row=end_row, min_col=start_column, max_col=end_column).coord)
+
     # --- Row 1: Title + SUM headers ---
-    ws.merge_cells(start_row=1, end_row=1, start_column=1, end_column=5)
-    ws.cell(row=1, column=1, value=semester).font = FONT_TITLE
-    ws.cell(row=1, column=1).alignment = ALIGN_CENTER
+    merge(1, 1, 1, 5)
+    cells.append((1, 1, semester, STYLE_TITLE))
 
-    for a_idx, lay in enumerate(aufgabe_layouts):
-        aufgabe_nr = a_idx + 1
+    for lay in aufgabe_layouts:
         # "SUM" merged over SS + S cols, rows 1-2
-        ws.merge_cells(start_row=1, end_row=2, start_column=lay["ss_col"], end_column=lay["sum_block_end"])
-        ws.cell(row=1, column=lay["ss_col"], value="SUM").font = FONT_TITLE
-        ws.cell(row=1, column=lay["ss_col"]).alignment = ALIGN_CENTER
-
-    # --- Row 2: Datum, Mappe, Teilaufgabe labels ---
-    ws.merge_cells(start_row=2, end_row=2, start_column=1, end_column=2)
-    ws.cell(row=2, column=1, value="Datum:").font = FONT_TITLE
-    ws.cell(row=2, column=1).alignment = Alignment(horizontal="right", vertical="center")
-    ws.cell(row=2, column=3, value=exam_date).font = FONT_TITLE
-    ws.cell(row=2, column=3).alignment = ALIGN_CENTER
-    ws.cell(row=2, column=3).number_format = "DD.MM.YYYY"
-    ws.cell(row=2, column=4, value="Mappe").font = FONT_TITLE
-    ws.cell(row=2, column=4).alignment = ALIGN_CENTER
-    ws.cell(row=2, column=5, value=mappe_nr).font = FONT_TITLE
-    ws.cell(row=2, column=5).alignment = ALIGN_CENTER
+        merge(1, 2, lay["ss_col"], lay["sum_block_end"])
+        cells.append((1, lay["ss_col"], "SUM", STYLE_TITLE))
+
+    # --- Row 2: Datum, Mappe, Teilaufgabe labels (Mappe number is set per sheet) ---
+    merge(2, 2, 1, 2)
+    cells.append((2, 1, "Datum:", STYLE_TITLE_RIGHT))
+    cells.append((2, 3, exam_date, STYLE_DATE))
+    cells.append((2, 4, "Mappe", STYLE_TITLE))
 
     for a_idx, lay in enumerate(aufgabe_layouts):
         aufgabe_nr = a_idx + 1
         for t_idx, pts in enumerate(lay["teil_punkte"]):
             start_c = lay["teil_point_starts"][t_idx]
             end_c = start_c + pts - 1
-            label = f"A{aufgabe_nr}.{t_idx + 1}"
             if end_c > start_c:
-                ws.merge_cells(start_row=2, end_row=2, start_column=start_c, end_column=end_c)
-            ws.cell(row=2, column=start_c, value=label).font = FONT_TITLE
-            ws.cell(row=2, column=start_c).alignment = ALIGN_CENTER
+                merge(2, 2, start_c, end_c)
+            cells.append((2, start_c, f"A{aufgabe_nr}.{t_idx + 1}", STYLE_TITLE))
 
-    # --- Row 3: Sub-task descriptions (rotated 90°) ---
-    ws.cell(row=3, column=5, value="Richtige Klausur?").font = FONT_NORMAL
-    ws.cell(row=3, column=5).alignment = ALIGN_CENTER_WRAP
-    ws.cell(row=3, column=5).fill = FILL_GRAY
+    # --- Rows 4-6: labels in columns A-E ---
+    for c, v in {1: "Nr", 2: "Matr-Nr", 3: "Nachname", 4: "Vorname"}.items():
+        cells.append((4, c, v, STYLE_HEADER))
+    cells.append((4, 5, None, STYLE_GRAY_CENTER))
 
-    for a_idx, lay in enumerate(aufgabe_layouts):
-        aufgabe_nr = a_idx + 1
-        n_teil = lay["n_teil"]
+    for r, label in ((5, "Maximale Punkte"), (6, "Durchschnittliche Punkte")):
+        merge(r, r, 1, 5)
+        cells.append((r, 1, label, STYLE_HEADER))
+        cells.extend((r, c, None, STYLE_GRAY) for c in range(2, 6))
 
-        # SS description
-        label_text = " + ".join(f"A{aufgabe_nr}.{t + 1}" for t in range(n_teil))
-        ws.cell(row=3, column=lay["ss_col"], value=label_text).font = FONT_NORMAL
-        ws.cell(row=3, column=lay["ss_col"]).alignment = ALIGN_CENTER_WRAP
-        ws.cell(row=3, column=lay["ss_col"]).fill = FILL_GRAY
+    # --- Rows 3-6: Aufgabe columns ---
+    # Row 3: sub-task descriptions (rotated 90°), row 4: column headers,
+    # row 5: Maximale Punkte, row 6: Durchschnittliche Punkte.
+    # Collected in column order: all SUM blocks, then all point columns.
+    cells.append((3, 5, "Richtige Klausur?", STYLE_DESCRIPTION))
 
-        # S descriptions
-        for t_idx in range(n_teil):
-            ws.cell(row=3, column=lay["s_cols"][t_idx], value=f"A{aufgabe_nr}.{t_idx + 1}").font = FONT_NORMAL
-            ws.cell(row=3, column=lay["s_cols"][t_idx]).alignment = ALIGN_CENTER_WRAP
-            ws.cell(row=3, column=lay["s_cols"][t_idx]).fill = FILL_GRAY
+    for a_idx, (lay, tpl) in enumerate(zip(aufgabe_layouts, formula_templates)):
+        aufgabe_nr = a_idx + 1
+        ss_col = lay["ss_col"]
 
-        # Point column descriptions
+        # SS = SUM of S cols
+        label_text = " + ".join(f"A{aufgabe_nr}.{t + 1}" for t in range(lay["n_teil"]))
+        cells.append((3, ss_col, label_text, STYLE_DESCRIPTION))
+        cells.append((4, ss_col, "SS", STYLE_HEADER))
+        cells.append((5, ss_col, tpl["ss_sum_row5"], STYLE_VALUE))
+        cells.append((6, ss_col, tpl["ss_sum_row6"], STYLE_AVERAGE))
+
+        for t_idx, s_col in enumerate(lay["s_cols"]):
+            cells.append((3, s_col, f"A{aufgabe_nr}.{t_idx + 1}", STYLE_DESCRIPTION))
+            cells.append((4, s_col, "S", STYLE_HEADER))
+            cells.append((5, s_col, tpl["teil_sum_row5"][t_idx], STYLE_VALUE))
+            cells.append((6, s_col, tpl["teil_sum_row6"][t_idx], STYLE_AVERAGE))
+
+    # Row-6 averages of the point columns depend on the number of students
+    averages = []
+    for lay in aufgabe_layouts:
         descs_list = lay["teil_descriptions"]
-        for t_idx in range(n_teil):
+        for t_idx, pts in enumerate(lay["teil_punkte"]):
             descs = descs_list[t_idx] if t_idx < len(descs_list) else []
-            for p in range(lay["teil_punkte"][t_idx]):
+            for p in range(pts):
                 pc = lay["teil_point_starts"][t_idx] + p
                 desc = descs[p] if p < len(descs) else ""
-                if desc:
-                    ws.cell(row=3, column=pc, value=desc).font = FONT_NORMAL
-                ws.cell(row=3, column=pc).alignment = ALIGN_CENTER_WRAP
-                ws.cell(row=3, column=pc).fill = FILL_GRAY
+                cells.append((3, pc, desc, STYLE_DESCRIPTION) if desc else (3, pc, None, STYLE_DESCRIPTION_EMPTY))
+                cells.append((4, pc, LETTERS[p % 26], STYLE_POINT_HEADER))
+                cells.append((5, pc, 1, STYLE_VALUE))
+                averages.append((pc, col_letters[pc]))
 
-    ws.row_dimensions[3].height = 148
+    # --- Student rows ---
+    # SUM range letters don't depend on the row, so resolve them once:
+    # (ss_col, first S letter, last S letter, [(s_col, first point letter, last point letter), ...])
+    sum_ranges = [
+        (
+            lay["ss_col"],
+            *tpl["ss_range"],
+            [(s_col, fp, lp) for s_col, (fp, lp) in zip(lay["s_cols"], tpl["teil_ranges"])],
+        )
+        for lay, tpl in zip(aufgabe_layouts, formula_templates)
+    ]
 
-    # --- Row 4: Column headers ---
-    for c, v in {1: "Nr", 2: "Matr-Nr", 3: "Nachname", 4: "Vorname"}.items():
-        cell = ws.cell(row=4, column=c, value=v)
-        cell.font = FONT_BOLD_12
-        cell.alignment = ALIGN_CENTER
-        cell.fill = FILL_GRAY
-    ws.cell(row=4, column=5).fill = FILL_GRAY
-    ws.cell(row=4, column=5).alignment = ALIGN_CENTER
-
-    letters = list(string.ascii_lowercase)
+    # --- Column widths ---
+    column_widths = {"A": 5.5, "B": 18, "C": 20, "D": 20, "E": 8}
     for lay in aufgabe_layouts:
-        ws.cell(row=4, column=lay["ss_col"], value="SS").font = FONT_BOLD_12
-        ws.cell(row=4, column=lay["ss_col"]).alignment = ALIGN_CENTER
-        ws.cell(row=4, column=lay["ss_col"]).fill = FILL_GRAY
-
+        column_widths[col_letters[lay["ss_col"]]] = 5
         for t_idx in range(lay["n_teil"]):
-            ws.cell(row=4, column=lay["s_cols"][t_idx], value="S").font = FONT_BOLD_12
-            ws.cell(row=4, column=lay["s_cols"][t_idx]).alignment = ALIGN_CENTER
-            ws.cell(row=4, column=lay["s_cols"][t_idx]).fill = FILL_GRAY
-
+            column_widths[col_letters[lay["s_cols"][t_idx]]] = 4.5
             for p in range(lay["teil_punkte"][t_idx]):
                 pc = lay["teil_point_starts"][t_idx] + p
-                ws.cell(row=4, column=pc, value=letters[p % 26]).font = FONT_BOLD_12
-                ws.cell(row=4, column=pc).alignment = ALIGN_CENTER
-                ws.cell(row=4, column=pc).fill = FILL_ORANGE
-
-    ws.row_dimensions[4].height = 21
-
-    # --- Row 5: Maximale Punkte ---
-    ws.merge_cells(start_row=5, end_row=5, start_column=1, end_column=5)
-    ws.cell(row=5, column=1, value="Maximale Punkte").font = FONT_BOLD_12
-    ws.cell(row=5, column=1).alignment = ALIGN_CENTER
-    for c in range(1, 6):
-        ws.cell(row=5, column=c).fill = FILL_GRAY
+                column_widths[col_letters[pc]] = 4.5
 
+    # --- Borders: (first row, first col, last col), each down to the last student row ---
+    outlines = [(4, 1, 5)]
     for lay in aufgabe_layouts:
-        # SS = SUM of S cols
-        ws.cell(row=5, column=lay["ss_col"],
-                value=f"=SUM({get_column_letter(lay['s_cols'][0])}5:{get_column_letter(lay['s_cols'][-1])}5)").font = FONT_NORMAL
-        ws.cell(row=5, column=lay["ss_col"]).alignment = ALIGN_CENTER
-        ws.cell(row=5, column=lay["ss_col"]).fill = FILL_GRAY
-
+        # SUM block
+        outlines.append((3, lay["ss_col"], lay["sum_block_end"]))
+        # Each Teilaufgabe point block
         for t_idx in range(lay["n_teil"]):
-            fp = get_column_letter(lay["teil_point_starts"][t_idx])
-            lp = get_column_letter(lay["teil_point_starts"][t_idx] + lay["teil_punkte"][t_idx] - 1)
-            ws.cell(row=5, column=lay["s_cols"][t_idx], value=f"=SUM({fp}5:{lp}5)").font = FONT_NORMAL
-            ws.cell(row=5, column=lay["s_cols"][t_idx]).alignment = ALIGN_CENTER
-            ws.cell(row=5, column=lay["s_cols"][t_idx]).fill = FILL_GRAY
+            start_c = lay["teil_point_starts"][t_idx]
+            outlines.append((3, start_c, start_c + lay["teil_punkte"][t_idx] - 1))
 
-            for p in range(lay["teil_punkte"][t_idx]):
-                pc = lay["teil_point_starts"][t_idx] + p
-                ws.cell(row=5, column=pc, value=1).font = FONT_NORMAL
-                ws.cell(row=5, column=pc).alignment = ALIGN_CENTER
-                ws.cell(row=5, column=pc).fill = FILL_GRAY
+    return {
+        "cells": cells,
+        "averages": averages,
+        "merges": merges,
+        "sum_ranges": sum_ranges,
+        "column_widths": column_widths,
+        "outlines": outlines,
+    }
 
-    # --- Row 6: Durchschnittliche Punkte ---
-    ws.merge_cells(start_row=6, end_row=6, start_column=1, end_column=5)
-    ws.cell(row=6, column=1, value="Durchschnittliche Punkte").font = FONT_BOLD_12
-    ws.cell(row=6, column=1).alignment = ALIGN_CENTER
-    for c in range(1, 6):
-        ws.cell(row=6, column=c).fill = FILL_GRAY
 
-    first_data_row = 7
-    last_data_row = 7 + n_students - 1
+def build_mappe_sheet(
+    wb: Workbook,
+    sheet_name: str,
+    template: dict,
+    students_in_mappe: pd.DataFrame,
+    mappe_nr: int,
+):
+    """Create one Mappe sheet by replaying the shared template for its students."""
+    ws = wb.create_sheet(title=sheet_name)
+    n_students = len(students_in_mappe)
 
-    for lay in aufgabe_layouts:
-        ws.cell(row=6, column=lay["ss_col"],
-                value=f"=SUM({get_column_letter(lay['s_cols'][0])}6:{get_column_letter(lay['s_cols'][-1])}6)").font = FONT_NORMAL
-        ws.cell(row=6, column=lay["ss_col"]).alignment = ALIGN_CENTER
-        ws.cell(row=6, column=lay["ss_col"]).fill = FILL_GRAY
-        ws.cell(row=6, column=lay["ss_col"]).number_format = "0.00"
+    # Write-only sheets stream rows in order, so cells are collected per row
+    # first and appended once all values, styles and borders are known.
+    grid: dict[int, dict[int, WriteOnlyCell]] = {}
+
+    def cell_at(row, column, value=None):
+        row_cells = grid.setdefault(row, {})
+        cell = row_cells.get(column)
+        if cell is None:
+            cell = row_cells[column] = WriteOnlyCell(ws)
+        if value is not None:
+            cell.value = value
+        return cell
+
+    # Write-only sheets need their dimensions before the first row is appended
+    for letter, width in template["column_widths"].items():
+        ws.column_dimensions[letter].width = width
+    for r, height in ((1, 26), (2, 30), (3, 148), (4, 21), (5, 16), (6, 17)):
+        ws.row_dimensions[r].height = height
+    # Write-only sheets have no merge_cells(); register the ranges directly
+    for coord in template["merges"]:
+        ws.merged_cells.add(coord)
+
+    # --- Rows 1-6 ---
+    for r, c, value, style in template["cells"]:
+        _apply_style(cell_at(row=r, column=c, value=value), *style)
+    _apply_style(cell_at(row=2, column=5, value=mappe_nr), *STYLE_TITLE)
 
-        for t_idx in range(lay["n_teil"]):
-            fp_l = get_column_letter(lay["teil_point_starts"][t_idx])
-            lp_l = get_column_letter(lay["teil_point_starts"][t_idx] + lay["teil_punkte"][t_idx] - 1)
-            ws.cell(row=6, column=lay["s_cols"][t_idx], value=f"=SUM({fp_l}6:{lp_l}6)").font = FONT_NORMAL
-            ws.cell(row=6, column=lay["s_cols"][t_idx]).alignment = ALIGN_CENTER
-            ws.cell(row=6, column=lay["s_cols"][t_idx]).fill = FILL_GRAY
-            ws.cell(row=6, column=lay["s_cols"][t_idx]).number_format = "0.00"
-
-            for p in range(lay["teil_punkte"][t_idx]):
-                pc = lay["teil_point_starts"][t_idx] + p
-                pc_l = get_column_letter(pc)
-                ws.cell(
-                    row=6, column=pc,
-                    value=f'=IFERROR(AVERAGE({pc_l}{first_data_row}:{pc_l}{last_data_row}),"")',
-                ).font = FONT_NORMAL
-                ws.cell(row=6, column=pc).alignment = ALIGN_CENTER
-                ws.cell(row=6, column=pc).fill = FILL_GRAY
-                ws.cell(row=6, column=pc).number_format = "0.00"
+    first_data_row = 7
+    last_data_row = 7 + n_students - 1
+    for pc, pc_l in template["averages"]:
+        _apply_style(
+            cell_at(row=6, column=pc, value=f'=IFERROR(AVERAGE({pc_l}{first_data_row}:{pc_l}{last_data_row}),"")'),
+            *STYLE_AVERAGE,
+        )
 
     # --- Student rows ---
-    for s_idx, (_, student) in enumerate(students_in_mappe.iterrows()):
+    student_values = students_in_mappe.map(str).to_numpy()
+    for s_idx, student in enumerate(student_values):
         r = 7 + s_idx
-        ws.cell(row=r, column=1, value=s_idx).alignment = ALIGN_CENTER
-        ws.cell(row=r, column=2, value=str(student.iloc[0])).alignment = ALIGN_CENTER
-        ws.cell(row=r, column=2).font = FONT_NORMAL
-        ws.cell(row=r, column=3, value=str(student.iloc[1])).alignment = ALIGN_CENTER
-        ws.cell(row=r, column=3).font = FONT_NORMAL
-        ws.cell(row=r, column=4, value=str(student.iloc[2])).alignment = ALIGN_CENTER
-        ws.cell(row=r, column=4).font = FONT_NORMAL
-
-        for lay in aufgabe_layouts:
+        cell_at(row=r, column=1, value=s_idx).alignment = ALIGN_CENTER
+        for c, value in enumerate(student, 2):
+            cell = cell_at(row=r, column=c, value=value)
+            cell.alignment = ALIGN_CENTER
+            cell.font = FONT_NORMAL
+
+        for ss_col, ss_first, ss_last, teil_ranges in template["sum_ranges"]:
             # SS = SUM of S cols
-            ws.cell(row=r, column=lay["ss_col"],
-                    value=f"=SUM({get_column_letter(lay['s_cols'][0])}{r}:{get_column_letter(lay['s_cols'][-1])}{r})").font = FONT_NORMAL
-            ws.cell(row=r, column=lay["ss_col"]).alignment = ALIGN_CENTER
-            ws.cell(row=r, column=lay["ss_col"]).fill = FILL_GRAY
-
-            for t_idx in range(lay["n_teil"]):
-                fp = get_column_letter(lay["teil_point_starts"][t_idx])
-                lp = get_column_letter(lay["teil_point_starts"][t_idx] + lay["teil_punkte"][t_idx] - 1)
-                ws.cell(row=r, column=lay["s_cols"][t_idx], value=f"=SUM({fp}{r}:{lp}{r})").font = FONT_NORMAL
-                ws.cell(row=r, column=lay["s_cols"][t_idx]).alignment = ALIGN_CENTER
-                ws.cell(row=r, column=lay["s_cols"][t_idx]).fill = FILL_GRAY
+            _apply_style(cell_at(row=r, column=ss_col, value=f"=SUM({ss_first}{r}:{ss_last}{r})"), *STYLE_VALUE)
 
-        ws.row_dimensions[r].height = 16
+            for s_col, fp, lp in teil_ranges:
+                _apply_style(cell_at(row=r, column=s_col, value=f"=SUM({fp}{r}:{lp}{r})"), *STYLE_VALUE)
 
-    # --- Column widths ---
-    ws.column_dimensions["A"].width = 5.5
-    ws.column_dimensions["B"].width = 18
-    ws.column_dimensions["C"].width = 20
-    ws.column_dimensions["D"].width = 20
-    ws.column_dimensions["E"].width = 8
-    for lay in aufgabe_layouts:
-        ws.column_dimensions[get_column_letter(lay["ss_col"])].width = 5
-        for t_idx in range(lay["n_teil"]):
-            ws.column_dimensions[get_column_letter(lay["s_cols"][t_idx])].width = 4.5
-            for p in range(lay["teil_punkte"][t_idx]):
-                pc = lay["teil_point_starts"][t_idx] + p
-                ws.column_dimensions[get_column_letter(pc)].width = 4.5
-
-    ws.row_dimensions[1].height = 26
-    ws.row_dimensions[2].height = 30
-    ws.row_dimensions[5].height = 16
-    ws.row_dimensions[6].height = 17
+        ws.row_dimensions[r].height = 16
 
     # --- Borders ---
     last_data_row_border = 6 + n_students
-    _set_medium_outline(ws, 4, last_data_row_border, 1, 5)
-    for lay in aufgabe_layouts:
-        # SUM block
-        _set_medium_outline(ws, 3, last_data_row_border, lay["ss_col"], lay["sum_block_end"])
-        # Each Teilaufgabe point block
-        for t_idx in range(lay["n_teil"]):
-            start_c = lay["teil_point_starts"][t_idx]
-            end_c = start_c + lay["teil_punkte"][t_idx] - 1
-            _set_medium_outline(ws, 3, last_data_row_border, start_c, end_c)
+    for min_row, min_col, max_col in template["outlines"]:
+        _set_medium_outline(cell_at, min_row, last_data_row_border, min_col, max_col)
+
+    # --- Emit rows ---
+    for r in range(1, max(grid) + 1):
+        row_cells = grid.get(r, {})
+        ws.append([row_cells.get(c) for c in range(1, max(row_cells, default=0) + 1)])
 
 
 def generate_excel(
@@ -432,35 +518,58 @@ def generate_excel(
     studis_pro_mappe: int,
     semester: str,
     exam_date,
-) -> bytes:
-    wb = Workbook()
-    n_students = len(students)
-    n_mappen = math.ceil(n_students / studis_pro_mappe)
+) -> io.BytesIO:
+    wb = Workbook(write_only=True)
 
     build_studenten_sheet(wb, students, studis_pro_mappe)
 
-    for m in range(n_mappen):
-        mappe_nr = m + 1
-        start_idx = m * studis_pro_mappe
-        end_idx = min(start_idx + studis_pro_mappe, n_students)
-        students_in_mappe = students.iloc[start_idx:end_idx]
+    # Everything but the student rows is identical on every Mappe sheet
+    aufgabe_layouts = _compute_aufgabe_layouts(aufgaben)
+    col_letters = _compute_col_letters(aufgabe_layouts)
+    formula_templates = _compute_formula_templates(aufgabe_layouts, col_letters)
+    template = _build_mappe_template(aufgabe_layouts, formula_templates, col_letters, semester, exam_date)
+
+    # One slice per Mappe; iloc clips the last one to the remaining students
+    for mappe_nr, start_idx in enumerate(range(0, len(students), studis_pro_mappe), 1):
+        students_in_mappe = students.iloc[start_idx:start_idx + studis_pro_mappe]
 
         sheet_name = f"Mappe {mappe_nr}"
 
         build_mappe_sheet(
             wb=wb,
             sheet_name=sheet_name,
-            aufgaben=aufgaben,
+            template=template,
             students_in_mappe=students_in_mappe,
             mappe_nr=mappe_nr,
-            semester=semester,
-            exam_date=exam_date,
         )
 
+    # Hand out the buffer itself; getvalue() would copy the whole file
     buf = io.BytesIO()
     wb.save(buf)
     buf.seek(0)
-    return buf.getvalue()
+    return buf
+
+
+@st.cache_data(
+    show_spinner=False,
+    max_entries=8,
+    hash_funcs={pd.DataFrame: lambda df: pd.util.hash_pandas_object(df).values.tobytes()},
+)
+def generate_excel_cached(
+    students: pd.DataFrame,
+    aufgaben: list[dict],
+    studis_pro_mappe: int,
+    semester: str,
+    exam_date,
+) -> bytes:
+    """generate_excel, memoized on its inputs so repeated clicks reuse the file."""
+    return generate_excel(
+        students=students,
+        aufgaben=aufgaben,
+        studis_pro_mappe=studis_pro_mappe,
+        semester=semester,
+        exam_date=exam_date,
+    ).getvalue()
 
 
 # ---------------------------------------------------------------------------
@@ -529,11 +638,10 @@ for a_idx, aufgabe in enumerate(st.session_state.aufgaben):
             with tcol2:
                 # Optional descriptions for each point column
                 desc_cols = st.columns(min(ta["punkte"], 6))
-                letters = list(string.ascii_lowercase)
                 for p_idx in range(ta["punkte"]):
                     with desc_cols[p_idx % len(desc_cols)]:
                         new_desc = st.text_input(
-                            f"{letters[p_idx % 26]})",
+                            f"{LETTERS[p_idx % 26]})",
                             value=ta["descriptions"][p_idx] if p_idx < len(ta["descriptions"]) else "",
                             key=f"desc_{a_idx}_{t_idx}_{p_idx}",
                             placeholder="Beschreibung (optional)",
@@ -603,7 +711,7 @@ if uploaded_file is not None:
 
     if st.button("Punktezettel erstellen", type="primary"):
         with st.spinner("Excel wird erstellt..."):
-            excel_bytes = generate_excel(
+            excel_file = generate_excel_cached(
                 students=students,
                 aufgaben=st.session_state.aufgaben,
                 studis_pro_mappe=int(studis_pro_mappe),
@@ -613,7 +721,7 @@ if uploaded_file is not None:
 
         st.download_button(
             label="Download Punktezettel (.xlsx)",
-            data=excel_bytes,
+            data=excel_file,
             file_name=f"Punktezettel_{semester.replace(' ', '_').replace('/', '')}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         )